@@ -1,5 +1,8 @@
 from dataclasses import dataclass
-from typing import Any, Iterable, Protocol
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from functools import lru_cache
+from typing import Any, Iterable, Optional, Protocol
 import dspy
 from vlms4vids.prompts import DEFAULT_SYSTEM_PROMPT
 
@@ -10,6 +13,8 @@ class AnalyzerConfig:
     temperature: float = 1.0
     max_tokens: int = 20_000
     api_key: str = None
+    chunk_size: Optional[int] = None  # Split frames into windows of this size, analyzed in parallel then merged
+    max_parallel: int = 8  # Maximum concurrent LLM calls when analyzing windows
 
 class VideoSignature(dspy.Signature):
     """You are a helpful assistant that can answer questions about a video"""
@@ -23,20 +28,30 @@ class VideoChatSignature(dspy.Signature):
     chat_history: list[dict[str, str]] = dspy.InputField(desc="A list of previous messages between the user and the assistant")
     answer: str = dspy.OutputField(desc="An answer to the question")
 
+class MergeAnswersSignature(dspy.Signature):
+    """Combine answers about consecutive segments of a video into a single answer about the whole video"""
+    partial_answers: list[str] = dspy.InputField(desc="Answers for consecutive segments of the video, in order")
+    system_prompt: str = dspy.InputField(desc="The prompt the answers respond to")
+    answer: str = dspy.OutputField(desc="An answer to the prompt covering the whole video")
     
 
+@lru_cache(maxsize=8)
+def _get_lm(model_name: str, api_key: Optional[str], temperature: float, max_tokens: int) -> dspy.LM:
+    # Analyzers with the same settings share one LM and its HTTP connection pool
+    return dspy.LM(model_name, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
+
 class Analyzer(Protocol):
     def __call__(self, frames: Iterable[dspy.Image], cfg: AnalyzerConfig) -> Any:
         ...
 
 class DSPyAnalyzer(Analyzer):
     def __init__(self, cfg: AnalyzerConfig):
-        lm = dspy.LM(cfg.model_name, api_key=cfg.api_key, temperature=cfg.temperature, max_tokens=cfg.max_tokens)
-        dspy.configure(lm=lm)
+        self.cfg = cfg
+        dspy.configure(lm=_get_lm(cfg.model_name, cfg.api_key, cfg.temperature, cfg.max_tokens))
 
     def change_config(self, cfg: AnalyzerConfig):
-        lm = dspy.LM(cfg.model_name, api_key=cfg.api_key, temperature=cfg.temperature, max_tokens=cfg.max_tokens)
-        dspy.configure(lm=lm)
+        self.cfg = cfg
+        dspy.configure(lm=_get_lm(cfg.model_name, cfg.api_key, cfg.temperature, cfg.max_tokens))
         # https://github.com/stanfordnlp/dspy/issues/1589
         # above link is a bug in dspy - check if it's fixed
     
@@ -54,17 +69,33 @@ class SimpleVideoAnalyzer(DSPyAnalyzer):
             )
         self.signature = signature
 
-        # add chat_history to signature if not present
-        if "chat_history" or "messages" not in signature.input_fields:
-            signature = signature.prepend(
+        # add chat_history to a separate chat signature if not present, self.signature stays untouched
+        chat_signature = signature
+        if "chat_history" not in chat_signature.input_fields and "messages" not in chat_signature.input_fields:
+            chat_signature = chat_signature.prepend(
                 name="chat_history",
                 field=dspy.InputField(desc="A list of previous messages between the user and the assistant"),
                 type_=list[dict[str, str]]
             )
-        self.chat_signature = signature
+        self.chat_signature = chat_signature
 
     def ask(self, frames: Iterable[dspy.Image], prompt: str) -> Any:
-        return self.dspy_module(self.signature)(frames=frames, system_prompt=prompt)
+        frames = list(frames)
+        chunk_size = self.cfg.chunk_size
+        if not chunk_size or len(frames) <= chunk_size:
+            return self.dspy_module(self.signature)(frames=frames, system_prompt=prompt)
+
+        def analyze(chunk: list[dspy.Image]) -> Any:
+            return self.dspy_module(self.signature)(frames=chunk, system_prompt=prompt)
+
+        # Calls are network bound, so threads overlap them without contending for the GIL.
+        # Each call runs in a copy of the caller's context to keep dspy.context(...) overrides
+        chunks = [frames[i:i + chunk_size] for i in range(0, len(frames), chunk_size)]
+        with ThreadPoolExecutor(max_workers=min(len(chunks), self.cfg.max_parallel)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, analyze, chunk) for chunk in chunks]
+            partials = [future.result() for future in futures]
+        partial_answers = [getattr(partial, "answer", str(partial)) for partial in partials]
+        return self.dspy_module(MergeAnswersSignature)(partial_answers=partial_answers, system_prompt=prompt)
     
     def chat(self, frames: Iterable[dspy.Image], messages: list[dict[str, str]]) -> Any:
         return self.dspy_module(self.chat_signature)(frames=frames, chat_history=messages)
@@ -1,19 +1,20 @@
-from dataclasses import dataclass
-from typing import Protocol, Optional, Tuple, Iterable
-from extractors.utils import VideoProcessingConfig, extract_frames_from_video
+from dataclasses import dataclass, replace
+from typing import Protocol, Optional, Iterable, Iterator, List
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+import os
+from extractors.utils import MJPEGEncoder, VideoProcessingConfig, available_cpus, extract_frames_from_video, iter_frames_from_video
+import base64
 import numpy as np
 import dspy
-from PIL import Image
 
 @dataclass
-class VideoExtractorConfig:
-    """Configuration for frame extraction"""
-    resize_dims: Optional[Tuple[int, int]] = None  # (width, height)
-    resize_scale: Optional[float] = None  # Scale factor between 0-1
-    fps: Optional[float] = 1.0  # Frames per second to extract
-    start_time: Optional[str] = None  # Start time in HH:MM:SS.xxx format
-    end_time: Optional[str] = None  # End time in HH:MM:SS.xxx format
-    max_frames: Optional[int] = None  # Maximum number of frames
+class VideoExtractorConfig(VideoProcessingConfig):
+    """
+    Configuration for frame extraction, see VideoProcessingConfig for the processing fields.
+    output_path stays the 7th positional field, hwaccel, pix_fmt and keyframes_only are keyword-only.
+    """
     output_path: Optional[str] = None  # Path to save frames if needed
 
 class VideoExtractor(Protocol):
@@ -23,26 +24,65 @@ class VideoExtractor(Protocol):
 class DefaultVideoExtractor:
     """Default implementation of frame extraction using utils.py"""
     def __call__(self, video_path: str, cfg: VideoExtractorConfig) -> Iterable[np.ndarray]:
-        # Convert ExtractorConfig to VideoProcessingConfig
-        video_cfg = VideoProcessingConfig(
-            resize_dims=cfg.resize_dims,
-            resize_scale=cfg.resize_scale,
-            fps=cfg.fps,
-            start_time=cfg.start_time,
-            end_time=cfg.end_time,
-            max_frames=cfg.max_frames
-        )
-        
         # Extract frames using the utility function
         return extract_frames_from_video(
             input_path=video_path,
             output_path=cfg.output_path,
-            config=video_cfg
+            config=cfg
         )
+
+    def iter_frames(self, video_path: str, cfg: VideoExtractorConfig) -> Iterator[np.ndarray]:
+        """Stream frames one at a time instead of materializing the whole video"""
+        return iter_frames_from_video(video_path, cfg)
+
+def _extract_one(video_path: str, cfg: VideoExtractorConfig, save_workers: int) -> Iterable[np.ndarray]:
+    # Module level so that it can be pickled by ProcessPoolExecutor
+    return extract_frames_from_video(video_path, cfg.output_path, cfg, save_workers)
+
+class BatchVideoExtractor:
+    """
+    Extract frames from several videos in parallel, one ffmpeg process per video.
+    With output_path set, frames of each video are saved to output_path/<video file stem>.
+    """
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+
+    def __call__(self, video_paths: List[str], cfg: VideoExtractorConfig) -> List[Iterable[np.ndarray]]:
+        if not video_paths:
+            return []
+        cfgs = [cfg] * len(video_paths)
+        if cfg.output_path:
+            stems = [Path(video_path).stem for video_path in video_paths]
+            if len(set(stems)) != len(stems):
+                raise ValueError("Videos saved to output_path need distinct file names")
+            cfgs = [replace(cfg, output_path=os.path.join(cfg.output_path, stem)) for stem in stems]
+            for video_cfg in cfgs:
+                os.makedirs(video_cfg.output_path, exist_ok=True)
+
+        cpus = available_cpus()
+        max_workers = self.max_workers or min(len(video_paths), cpus)
+        # Share the CPUs between processes so frame saving threads don't oversubscribe them
+        save_workers = max(1, cpus // max_workers)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(partial(_extract_one, save_workers=save_workers), video_paths, cfgs))
     
 class VideoExtractor4Dspy(DefaultVideoExtractor):
     """DSPy implementation of frame extraction"""
     def __call__(self, video_path: str, cfg: VideoExtractorConfig) -> Iterable[dspy.Image]:
-        frames = super().__call__(video_path, cfg)
-        video_frames = [Image.fromarray(np.uint8(frame)) for frame in frames]
-        return [dspy.Image.from_PIL(frame) for frame in video_frames]
\ No newline at end of file
+        # DSPy signatures take a list, and the same frames are often reused across calls
+        return list(self.iter_images(video_path, cfg))
+
+    def iter_images(self, video_path: str, cfg: VideoExtractorConfig) -> Iterator[dspy.Image]:
+        """Lazily extract and encode frames, holding only one raw frame in memory at a time"""
+        # Saving to output_path needs the extracted frames, otherwise stream them from ffmpeg
+        frames = super().__call__(video_path, cfg) if cfg.output_path else self.iter_frames(video_path, cfg)
+        yield from self.encode_frames(frames, cfg.pix_fmt)
+
+    @staticmethod
+    def encode_frames(frames: Iterable[np.ndarray], pix_fmt: str = 'rgb24') -> Iterator[dspy.Image]:
+        # Encode straight to JPEG with a single reused encoder instead of going through PIL,
+        # which also keeps the payload sent to the VLM small
+        with MJPEGEncoder(qscale=4) as encoder:
+            for frame in frames:
+                jpg = encoder.encode(frame, pix_fmt)
+                yield dspy.Image(url=f"data:image/jpeg;base64,{base64.b64encode(jpg).decode('ascii')}")
@@ -1,7 +1,17 @@
-from typing import List, Optional, Tuple
-from dataclasses import dataclass
+from typing import Iterator, Optional, Sequence, Tuple
+from dataclasses import KW_ONLY, dataclass, replace
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from functools import lru_cache
+import math
+import os
+import re
+import subprocess
+import tempfile
+import warnings
 import numpy as np
-from PIL import Image
+import av
+from av.video.reformatter import VideoReformatter
 import ffmpeg
 
 @dataclass
@@ -9,16 +19,110 @@ class VideoProcessingConfig:
     """Configuration for video frame extraction"""
     resize_dims: Optional[Tuple[int, int]] = None  # (width, height)
     resize_scale: Optional[float] = None  # Scale factor between 0-1 to resize frames
-    fps: Optional[float] = 1.0  # Extract n frames per second
+    fps: Optional[float] = 1.0  # Extract n frames per second (approximate when decimating by >= 4x, see _decimation_step)
     start_time: Optional[str] = None  # Start time in HH:MM:SS.xxx format
     end_time: Optional[str] = None  # End time in HH:MM:SS.xxx format
     max_frames: Optional[int] = None  # Maximum number of frames to extract
+    # Options below are keyword-only, so subclasses can add positional fields after max_frames
+    _: KW_ONLY
+    hwaccel: Optional[str] = None  # Hardware decoder, 'cuda', 'vaapi' or 'qsv', falls back to CPU on failure
+    pix_fmt: str = 'rgb24'  # Output pixel format, 'rgb24' or planar 'yuv420p' (half the bytes)
+    keyframes_only: bool = False  # Only decode keyframes (fast, but frames follow the GOP spacing and fps is ignored)
+
+def available_cpus() -> int:
+    """Number of CPUs this process may run on, respecting affinity masks (e.g. taskset, containers)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+# Supported hardware decoders and the device pixel format their frames are kept in
+_HWACCEL_OUTPUT_FORMATS = {'cuda': 'cuda', 'vaapi': 'vaapi', 'qsv': 'qsv'}
+
+# Bytes per pixel of the supported output pixel formats
+_PIX_FMTS = ('rgb24', 'yuv420p')
+
+def frame_shape(width: int, height: int, pix_fmt: str = 'rgb24') -> Tuple[int, ...]:
+    """Array shape of a single frame, yuv420p frames are stored as planar I420 (Y, then U, then V)"""
+    if pix_fmt == 'rgb24':
+        return (height, width, 3)
+    if pix_fmt == 'yuv420p':
+        return (height * 3 // 2, width)
+    raise ValueError(f"Unsupported pix_fmt: {pix_fmt}, expected one of {list(_PIX_FMTS)}")
+
+class MJPEGEncoder:
+    """
+    Encode frames to JPEG reusing one PyAV MJPEG codec context and colorspace converter,
+    instead of setting up an encoder for every image. The context is opened on the first
+    frame, so all frames must have the same size. Not thread-safe, use one per thread.
+    """
+    def __init__(self, qscale: int = 2):
+        self.qscale = qscale  # JPEG quantizer, 2 (best) to 31 (worst)
+        self.reformatter = VideoReformatter()
+        self.codec = None
+        self.n_frames = 0
+
+    def __enter__(self) -> "MJPEGEncoder":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def encode(self, frame: np.ndarray, pix_fmt: str = 'rgb24') -> bytes:
+        """Encode a frame laid out as frame_shape(width, height, pix_fmt) to JPEG bytes"""
+        video_frame = av.VideoFrame.from_ndarray(frame, format=pix_fmt)
+        video_frame = self.reformatter.reformat(video_frame, format='yuvj420p')
+        if self.codec is None:
+            self._open(video_frame.width, video_frame.height)
+        elif (video_frame.width, video_frame.height) != (self.codec.width, self.codec.height):
+            raise ValueError(
+                f"Frame size {video_frame.width}x{video_frame.height} does not match "
+                f"the encoder size {self.codec.width}x{self.codec.height}"
+            )
+        video_frame.pts = self.n_frames
+        self.n_frames += 1
+        return b''.join(bytes(packet) for packet in self.codec.encode(video_frame))
+
+    def close(self) -> None:
+        if self.codec is not None:
+            # Flush the encoder, MJPEG is intra-only so no packets are left behind
+            self.codec.encode(None)
+            self.codec = None
+
+    def _open(self, width: int, height: int) -> None:
+        codec = av.CodecContext.create('mjpeg', 'w')
+        codec.width = width
+        codec.height = height
+        codec.pix_fmt = 'yuvj420p'
+        codec.time_base = Fraction(1, 1)
+        # Parallelism comes from encoding separate frames concurrently, not slices of one frame
+        codec.thread_count = 1
+        # Fixed quantizer instead of bitrate control
+        codec.options = {'qmin': str(self.qscale), 'qmax': str(self.qscale)}
+        codec.open()
+        self.codec = codec
+
+def _decimation_step(config: VideoProcessingConfig, src_fps: Optional[float]) -> Optional[int]:
+    """
+    Keep every n-th frame instead of using the fps filter when decimating heavily, None otherwise.
+    The output rate becomes src_fps / step, which only approximates config.fps (e.g. 30 -> 7 gives 7.5).
+    """
+    if config.keyframes_only or not (config.fps and src_fps) or src_fps / config.fps < 4:
+        return None
+    return round(src_fps / config.fps)
+
+def _output_fps(config: VideoProcessingConfig, src_fps: Optional[float]) -> Optional[float]:
+    """Frame rate ffmpeg actually outputs for this config, None if unknown"""
+    step = _decimation_step(config, src_fps)
+    if step:
+        return src_fps / step
+    return config.fps or src_fps
 
 def transform_video_stream(
     stream: ffmpeg.Stream,
     config: VideoProcessingConfig,
     orig_width: int,
-    orig_height: int
+    orig_height: int,
+    src_fps: Optional[float] = None
 ) -> Tuple[ffmpeg.Stream, int, int]:
     """
     Apply transformations (resize, fps) to video stream
@@ -28,6 +132,7 @@ def transform_video_stream(
         config: Processing configuration
         orig_width: Original video width
         orig_height: Original video height
+        src_fps: Original video frame rate, if known
         
     Returns:
         Tuple of (transformed stream, new width, new height)
@@ -42,12 +147,39 @@ def transform_video_stream(
         width = config.resize_dims[0] if config.resize_dims else orig_width
         height = config.resize_dims[1] if config.resize_dims else orig_height
     
+    frame_shape(width, height, config.pix_fmt)  # Rejects unsupported pixel formats
+    if config.pix_fmt == 'yuv420p':
+        # Chroma is subsampled 2x2, keep dimensions even so frames have a fixed byte size
+        width, height = width - width % 2, height - height % 2
+    
     # Apply filters one by one instead of joining them
-    if config.fps:
+    # With keyframes_only every decoded frame is a keyframe and all of them are kept
+    step = _decimation_step(config, src_fps)
+    if step:
+        # Heavy decimation, keep every n-th frame by index instead of resampling timestamps
+        stream = stream.filter('select', f'not(mod(n,{step}))').filter('setpts', 'N/FRAME_RATE/TB')
+    elif config.fps and not config.keyframes_only:
         stream = stream.filter('fps', fps=config.fps)
     
-    if config.resize_scale or config.resize_dims:
-        stream = stream.filter('scale', width, height)
+    resize = (width, height) != (orig_width, orig_height)
+    cuda = config.hwaccel == 'cuda'
+    
+    # Resize in VRAM so only the downscaled frames are copied back to the host
+    if resize and cuda:
+        stream = stream.filter('scale_cuda', w=width, h=height, format='nv12')
+    
+    # Hardware decoded frames live in device memory, copy them back for the CPU filters
+    if config.hwaccel:
+        stream = stream.filter('hwdownload').filter('format', 'nv12')
+    
+    if resize and not cuda:
+        # Area averaging is both cheaper and cleaner than bilinear for heavy downscaling
+        flags = 'area' if width * 2 < orig_width else 'fast_bilinear'
+        stream = stream.filter('scale', width, height, flags=flags)
+    
+    # Pin the output pixel format at the end of the graph; on the CPU path the scale filter
+    # already negotiates it with the rawvideo output, so this only matters after hwdownload
+    stream = stream.filter('format', config.pix_fmt)
         
     return stream, width, height
 
@@ -57,8 +189,9 @@ def extract_frames_from_buffer(
     width: int,
     height: int,
     max_frames: Optional[int] = None,
-    output_path: Optional[str] = None
-) -> List[np.ndarray]:
+    output_path: Optional[str] = None,
+    pix_fmt: str = 'rgb24'
+) -> np.ndarray:
     """
     Extract frames from raw video buffer
     
@@ -69,35 +202,233 @@ def extract_frames_from_buffer(
         height: Frame height
         max_frames: Maximum number of frames to extract
         output_path: Optional path to save frames
+        pix_fmt: Pixel format of the buffer, see frame_shape
         
     Returns:
-        List of numpy arrays containing frames
+        Array of shape (n_frames, *frame_shape) viewing the buffer (no copy)
     """
-    frames = []
-    
-    for i in range(0, len(buffer), frame_size):
-        if max_frames and len(frames) >= max_frames:
-            break
-            
-        frame_bytes = buffer[i:i + frame_size]
-        if len(frame_bytes) != frame_size:
-            break
-            
-        frame = np.frombuffer(frame_bytes, dtype=np.uint8)
-        frame = frame.reshape((height, width, 3))
-        frames.append(frame)
-        
-        if output_path:
-            img = Image.fromarray(frame)
-            img.save(f"{output_path}/frame_{len(frames):06d}.jpg")
+    n_frames = len(buffer) // frame_size
+    if max_frames:
+        n_frames = min(n_frames, max_frames)
+    
+    # Single zero-copy view over the buffer; a trailing partial frame is dropped
+    frames = np.frombuffer(buffer, dtype=np.uint8, count=n_frames * frame_size)
+    frames = frames.reshape((n_frames, *frame_shape(width, height, pix_fmt)))
+    
+    if output_path:
+        _save_frames(frames, output_path, pix_fmt)
     
     return frames
 
+def _save_frames(
+    frames: Sequence[np.ndarray],
+    output_path: str,
+    pix_fmt: str = 'rgb24',
+    max_workers: Optional[int] = None
+) -> None:
+    """Write frames as frame_000001.jpg, frame_000002.jpg, ... using one MJPEG encoder per thread"""
+    n_workers = min(max_workers or available_cpus(), len(frames)) or 1
+    
+    def write(worker: int) -> None:
+        # Each worker encodes an interleaved share of the frames with its own encoder
+        with MJPEGEncoder() as encoder:
+            for i in range(worker, len(frames), n_workers):
+                with open(f"{output_path}/frame_{i + 1:06d}.jpg", 'wb') as f:
+                    f.write(encoder.encode(frames[i], pix_fmt))
+    
+    # Frames are independent and PyAV releases the GIL while encoding
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        # Consume the results so that write errors propagate
+        list(executor.map(write, range(n_workers)))
+
+@lru_cache(maxsize=256)
+def _cached_probe(path: str, mtime_ns: int) -> dict:
+    return ffmpeg.probe(path)
+
+def _probe_video(input_path: str) -> dict:
+    # Repeated runs over the same file skip the ffprobe subprocess, the mtime invalidates edited files.
+    # URLs and other inputs ffmpeg opens itself have no mtime and are probed every time
+    if not os.path.isfile(input_path):
+        return ffmpeg.probe(input_path)
+    path = os.path.abspath(input_path)
+    return _cached_probe(path, os.stat(path).st_mtime_ns)
+
+def _video_stream_info(probe: dict) -> dict:
+    return next(s for s in probe['streams'] if s['codec_type'] == 'video')
+
+def _frame_rate(video_info: dict) -> Optional[float]:
+    """Average frame rate of a probed video stream, None if unknown"""
+    try:
+        return float(Fraction(video_info.get('avg_frame_rate', '0/0'))) or None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+def _estimate_frame_count(probe: dict, config: VideoProcessingConfig) -> Optional[int]:
+    """Upper estimate of the number of frames ffmpeg will output, None if the duration is unknown"""
+    video_info = _video_stream_info(probe)
+    duration = float(probe.get('format', {}).get('duration') or video_info.get('duration') or 0)
+    if config.end_time:
+        end = _time_to_seconds(config.end_time)
+        duration = min(duration, end) if duration else end
+    duration -= _time_to_seconds(config.start_time)
+    
+    fps = _output_fps(config, _frame_rate(video_info))
+    if duration <= 0 or not fps or config.keyframes_only:
+        return None
+    # The fps and select filters may emit an extra frame at the boundaries of the range
+    n_frames = math.ceil(duration * fps) + 1
+    return min(n_frames, config.max_frames) if config.max_frames else n_frames
+
+def _build_stream(
+    input_path: str,
+    config: VideoProcessingConfig,
+    probe: dict
+) -> Tuple[ffmpeg.Stream, int, int]:
+    """Build the ffmpeg command piping raw frames to stdout, returns (stream, width, height)"""
+    if config.hwaccel and config.hwaccel not in _HWACCEL_OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported hwaccel: {config.hwaccel}, expected one of {list(_HWACCEL_OUTPUT_FORMATS)}")
+    
+    # Start building the ffmpeg stream
+    input_kwargs = {}
+    if config.hwaccel:
+        input_kwargs.update(
+            hwaccel=config.hwaccel,
+            hwaccel_output_format=_HWACCEL_OUTPUT_FORMATS[config.hwaccel]
+        )
+    
+    # Add time range if specified, as input options so that ffmpeg seeks to the nearest
+    # keyframe and stops reading at the end instead of decoding the whole file
+    if config.start_time:
+        input_kwargs['ss'] = config.start_time
+    if config.end_time:
+        input_kwargs['to'] = config.end_time
+    if config.keyframes_only:
+        # The decoder skips all non-keyframes, so most of the video is never decoded
+        input_kwargs['skip_frame'] = 'nokey'
+    stream = ffmpeg.input(input_path, **input_kwargs)
+    
+    # Get video info
+    video_info = _video_stream_info(probe)
+    orig_width = int(video_info['width'])
+    orig_height = int(video_info['height'])
+    
+    # Apply transformations
+    stream, width, height = transform_video_stream(
+        stream, config, orig_width, orig_height, _frame_rate(video_info)
+    )
+    
+    # Configure output stream, only errors go to stderr
+    stream = stream.output('pipe:', format='rawvideo', pix_fmt=config.pix_fmt)
+    stream = stream.global_args('-hide_banner', '-nostats', '-loglevel', 'error')
+    return stream, width, height
+
+class _FramePipe:
+    """ffmpeg process writing raw frames to stdout, stopped on exit if still running"""
+    def __init__(self, input_path: str, config: VideoProcessingConfig, probe: dict):
+        stream, width, height = _build_stream(input_path, config, probe)
+        self.shape = frame_shape(width, height, config.pix_fmt)
+        self.frame_size = int(np.prod(self.shape))
+        # stderr goes to a file rather than a pipe: damaged streams log an error per bad frame,
+        # and an unread pipe would fill up and block ffmpeg while we wait on stdout
+        self.stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(
+            ffmpeg.compile(stream),
+            stdout=subprocess.PIPE,
+            stderr=self.stderr,
+            # Unbuffered, so that readinto copies from the pipe straight into the frame array
+            bufsize=0
+        )
+    
+    def __enter__(self) -> "_FramePipe":
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        # Stop decoding once max_frames is hit, on errors or when a consumer stops iterating
+        # Close stdout before waiting, ffmpeg exits on SIGTERM only once it can't write to a full pipe
+        if self.proc.returncode is None:
+            self.proc.terminate()
+        self.proc.stdout.close()
+        self.proc.wait()
+        self.stderr.close()
+    
+    def read(self) -> Optional[np.ndarray]:
+        """Read the next frame into a new array, None at the end of the video"""
+        frame = np.empty(self.shape, dtype=np.uint8)
+        return frame if self.readinto(frame) else None
+    
+    def readinto(self, frame: np.ndarray) -> bool:
+        """Read the next frame directly into a contiguous array, False at the end of the video"""
+        # The unbuffered pipe may return less than a frame per call
+        view = memoryview(frame).cast('B')
+        n_read = 0
+        while n_read < self.frame_size:
+            n = self.proc.stdout.readinto(view[n_read:])
+            if not n:
+                return False
+            n_read += n
+        return True
+    
+    def finish(self) -> None:
+        """Wait for ffmpeg to exit after the last frame, raising ffmpeg.Error if it failed"""
+        self.proc.wait()
+        if self.proc.returncode != 0:
+            self.stderr.seek(0)
+            raise ffmpeg.Error('ffmpeg', None, self.stderr.read())
+
+def _retry_on_cpu(error: ffmpeg.Error, config: VideoProcessingConfig, n_frames: int) -> bool:
+    """Whether a failed run should be retried with software decoding, reports the error otherwise"""
+    if config.hwaccel and n_frames == 0:
+        # Codec or GPU not supported by the hardware decoder (e.g. AV1 on Pascal)
+        warnings.warn(
+            f"Hardware decoding with {config.hwaccel!r} failed, falling back to CPU decoding:\n"
+            f"{error.stderr.decode('utf-8', errors='replace')}",
+            RuntimeWarning
+        )
+        return True
+    print(f"FFmpeg stderr output:\n{error.stderr.decode('utf-8', errors='replace')}")
+    return False
+
+def iter_frames_from_video(
+    input_path: str,
+    config: Optional[VideoProcessingConfig] = None
+) -> Iterator[np.ndarray]:
+    """
+    Lazily extract frames from a video file, reading one frame at a time from the ffmpeg pipe.
+    Peak memory is a few frames regardless of video length, and decoding overlaps with consumption.
+    
+    Args:
+        input_path: Path to input video file
+        config: VideoProcessingConfig object with processing parameters
+        
+    Yields:
+        Numpy arrays of shape frame_shape(width, height, config.pix_fmt) containing the frames
+    """
+    config = config or VideoProcessingConfig()
+    n_frames = 0
+    with _FramePipe(input_path, config, _probe_video(input_path)) as pipe:
+        while not config.max_frames or n_frames < config.max_frames:
+            frame = pipe.read()
+            if frame is None:
+                break
+            n_frames += 1
+            yield frame
+        else:
+            return
+        
+        try:
+            pipe.finish()
+            return
+        except ffmpeg.Error as e:
+            if not _retry_on_cpu(e, config, n_frames):
+                raise
+    yield from iter_frames_from_video(input_path, replace(config, hwaccel=None))
+
 def extract_frames_from_video(
     input_path: str,
     output_path: Optional[str] = None,
-    config: Optional[VideoProcessingConfig] = None
-) -> List[np.ndarray]:
+    config: Optional[VideoProcessingConfig] = None,
+    save_workers: Optional[int] = None
+) -> np.ndarray:
     """
     Extract frames from a video file using python-ffmpeg.
     This provides a more Pythonic interface to FFmpeg with better error handling.
@@ -106,59 +437,65 @@ def extract_frames_from_video(
         input_path: Path to input video file
         output_path: Optional path to save extracted frames
         config: VideoProcessingConfig object with processing parameters
+        save_workers: Threads used to save frames, defaults to the available CPUs
         
     Returns:
-        List of numpy arrays containing the extracted frames
+        Array of shape (n_frames, *frame_shape) containing the extracted frames
     """
     config = config or VideoProcessingConfig()
+    probe = _probe_video(input_path)
+    n_frames = 0
     
-    # Start building the ffmpeg stream
-    stream = ffmpeg.input(input_path)
-    
-    # Add time range if specified
-    if config.start_time:
-        stream = stream.filter('setpts', f'PTS-STARTPTS', start_time=config.start_time)
-    if config.end_time:
-        duration = _time_to_seconds(config.end_time) - _time_to_seconds(config.start_time or '00:00:00')
-        stream = stream.filter('setpts', f'PTS-STARTPTS', duration=duration)
-    
-    # Get video info
-    probe = ffmpeg.probe(input_path)
-    video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
-    orig_width = int(video_info['width'])
-    orig_height = int(video_info['height'])
+    with _FramePipe(input_path, config, probe) as pipe:
+        # Read straight into a single preallocated array when the frame count can be estimated
+        frames = np.empty((_estimate_frame_count(probe, config) or 0, *pipe.shape), dtype=np.uint8)
+        extra = []  # Frames past the estimate, or all of them if the duration is unknown
+        end_of_video = False
+        while not config.max_frames or n_frames < config.max_frames:
+            if n_frames < len(frames):
+                end_of_video = not pipe.readinto(frames[n_frames])
+            else:
+                frame = pipe.read()
+                end_of_video = frame is None
+                if not end_of_video:
+                    extra.append(frame)
+            if end_of_video:
+                break
+            n_frames += 1
+        
+        try:
+            if end_of_video:
+                pipe.finish()
+        except ffmpeg.Error as e:
+            if not _retry_on_cpu(e, config, n_frames):
+                raise
+            return extract_frames_from_video(input_path, output_path, replace(config, hwaccel=None), save_workers)
     
-    # Apply transformations
-    stream, width, height = transform_video_stream(stream, config, orig_width, orig_height)
+    if not extra:
+        frames = frames[:n_frames]
+    elif len(frames) == 0:
+        # Nothing was preallocated, copy the frames into one array only once
+        frames = np.stack(extra)
+    else:
+        frames = np.concatenate([frames, np.stack(extra)])
     
-    # Configure output stream
-    stream = stream.output('pipe:', format='rawvideo', pix_fmt='rgb24')
+    if output_path:
+        _save_frames(frames, output_path, config.pix_fmt, save_workers)
     
-    # Run the ffmpeg process
-    try:
-        out, err = stream.run(capture_stdout=True, capture_stderr=True)
-    except ffmpeg._run.Error as e:
-        print(f"FFmpeg stderr output:\n{e.stderr.decode('utf-8')}")
-        raise
-    
-    # Extract frames from buffer
-    frame_size = width * height * 3
-    return extract_frames_from_buffer(
-        out,
-        frame_size,
-        width,
-        height,
-        config.max_frames,
-        output_path
-    )
+    return frames
+
+_TIME_RE = re.compile(r'(\d+):(\d+):(\d+(?:\.\d*)?)')
 
+@lru_cache(maxsize=128)
 def _time_to_seconds(time_str: str) -> float:
     """Convert HH:MM:SS.xxx time format to seconds"""
     if not time_str:
         return 0
-        
-    h, m, s = time_str.split(':')
-    return float(h) * 3600 + float(m) * 60 + float(s)
+    
+    match = _TIME_RE.fullmatch(time_str)
+    if not match:
+        raise ValueError(f"Invalid time {time_str!r}, expected HH:MM:SS.xxx format")
+    return int(match[1]) * 3600 + int(match[2]) * 60 + float(match[3])
 
 # Example usage:
 """
@@ -0,0 +1,109 @@
+import contextvars
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+import dspy
+from vlms4vids.analyzers.analyzer import SimpleVideoAnalyzer
+from vlms4vids.extractors.extractor import VideoExtractor4Dspy, VideoExtractorConfig
+
+_POLL_INTERVAL = 0.1  # seconds between checks of the stop flag while blocked on a queue
+
+class _StageError:
+    """Carries an exception raised in a stage thread to the next stage"""
+    def __init__(self, error: BaseException):
+        self.error = error
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _drain(q: queue.Queue, stop: threading.Event) -> Iterator[Any]:
+    """Yield items from q until the None sentinel, re-raising upstream errors"""
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        if item is None:
+            return
+        if isinstance(item, _StageError):
+            raise item.error
+        yield item
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _run_stage(produce: Callable[[], Iterator[Any]], out: queue.Queue, stop: threading.Event) -> None:
+    items = produce()
+    try:
+        for item in items:
+            if not _put(out, item, stop):
+                return
+    except Exception as e:
+        _put(out, _StageError(e), stop)
+        return
+    finally:
+        # Closing the frame generator terminates ffmpeg if we stopped early
+        close = getattr(items, "close", None)
+        if close:
+            close()
+    _put(out, None, stop)
+
+class VideoAnalysisPipeline:
+    """
+    Analyze a video with decoding, dspy.Image conversion and VLM calls running concurrently.
+
+    Each stage runs in its own thread and hands work to the next one through a bounded queue,
+    so throughput is limited by the slowest stage instead of the sum of all three, and the
+    queues apply back-pressure to keep memory bounded. Frames are sent to the analyzer in
+    batches of `batch_size` and one response is yielded per batch.
+    """
+    def __init__(
+        self,
+        analyzer: SimpleVideoAnalyzer,
+        extractor: Optional[VideoExtractor4Dspy] = None,
+        batch_size: int = 16,
+        queue_size: int = 16
+    ):
+        self.analyzer = analyzer
+        self.extractor = extractor or VideoExtractor4Dspy()
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def ask(self, video_path: str, cfg: VideoExtractorConfig, prompt: str) -> Iterator[Any]:
+        frames: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        images: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        results: queue.Queue = queue.Queue()
+        stop = threading.Event()
+
+        def decode() -> Iterator[Any]:
+            return self.extractor.iter_frames(video_path, cfg)
+
+        def convert() -> Iterator[dspy.Image]:
+            return self.extractor.encode_frames(_drain(frames, stop), cfg.pix_fmt)
+
+        def analyze() -> Iterator[Any]:
+            return (self.analyzer.ask(batch, prompt) for batch in _batched(_drain(images, stop), self.batch_size))
+
+        for produce, out in ((decode, frames), (convert, images), (analyze, results)):
+            # Run each stage in a copy of the caller's context so dspy.context(...) settings apply
+            ctx = contextvars.copy_context()
+            threading.Thread(target=ctx.run, args=(_run_stage, produce, out, stop), daemon=True).start()
+
+        try:
+            yield from _drain(results, stop)
+        finally:
+            # Unblock and wind down the stage threads if the caller stops early
+            stop.set()
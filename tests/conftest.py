@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+_SRC = Path(__file__).resolve().parents[1] / "src"
+
+# extractors is imported as a top-level package, as src/vlms4vids/extractors/extractor.py does
+sys.path.insert(0, str(_SRC / "vlms4vids"))
+sys.path.insert(0, str(_SRC))
@@ -0,0 +1,37 @@
+import numpy as np
+import dspy
+from dspy.utils import DummyLM
+from vlms4vids.analyzers.analyzer import AnalyzerConfig, SimpleVideoAnalyzer, VideoSignature
+from vlms4vids.extractors.extractor import VideoExtractor4Dspy, VideoExtractorConfig
+from vlms4vids.pipeline import VideoAnalysisPipeline
+
+class _RecordingLM(DummyLM):
+    """DummyLM that counts the calls routed to it"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n_calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.n_calls += 1
+        return super().__call__(*args, **kwargs)
+
+class _FakeExtractor(VideoExtractor4Dspy):
+    def __init__(self, n_frames):
+        self.n_frames = n_frames
+
+    def iter_frames(self, video_path, cfg):
+        return (np.full((48, 64, 3), i, dtype=np.uint8) for i in range(self.n_frames))
+
+def test_pipeline_uses_dspy_context():
+    # Bypass __init__ so no global LM is configured; only dspy.context provides one
+    analyzer = SimpleVideoAnalyzer.__new__(SimpleVideoAnalyzer)
+    analyzer.cfg = AnalyzerConfig()
+    analyzer.dspy_module = dspy.Predict
+    analyzer.signature = VideoSignature
+    pipeline = VideoAnalysisPipeline(analyzer, _FakeExtractor(5), batch_size=2)
+
+    lm = _RecordingLM([{"answer": "ok"}] * 3)
+    with dspy.context(lm=lm):
+        answers = [result.answer for result in pipeline.ask("in.mp4", VideoExtractorConfig(), "describe")]
+    assert answers == ["ok"] * 3
+    assert lm.n_calls == 3
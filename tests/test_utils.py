@@ -0,0 +1,142 @@
+import numpy as np
+import ffmpeg
+import pytest
+from extractors import utils
+from extractors.utils import VideoProcessingConfig, extract_frames_from_buffer, frame_shape
+
+PROBE = {
+    'format': {'duration': '10.0'},
+    'streams': [
+        {'codec_type': 'audio'},
+        {'codec_type': 'video', 'width': 64, 'height': 48, 'avg_frame_rate': '30/1'},
+    ],
+}
+
+def test_frame_shape():
+    assert frame_shape(64, 48) == (48, 64, 3)
+    assert frame_shape(64, 48, 'yuv420p') == (72, 64)
+    with pytest.raises(ValueError):
+        frame_shape(64, 48, 'gray')
+
+def test_time_to_seconds():
+    assert utils._time_to_seconds('00:00:10.500') == 10.5
+    assert utils._time_to_seconds('01:02:03') == 3723
+    assert utils._time_to_seconds(None) == 0
+    with pytest.raises(ValueError):
+        utils._time_to_seconds('10.5')
+
+def test_extract_frames_from_buffer_is_a_view():
+    frame_size = 4 * 2 * 3
+    buffer = bytes(range(frame_size * 2)) + b'\x00' * (frame_size // 2)
+    frames = extract_frames_from_buffer(buffer, frame_size, 4, 2)
+    assert frames.shape == (2, 2, 4, 3)
+    assert frames[1].tobytes() == buffer[frame_size:2 * frame_size]
+    assert np.shares_memory(frames, np.frombuffer(buffer, dtype=np.uint8))
+    assert len(extract_frames_from_buffer(buffer, frame_size, 4, 2, max_frames=1)) == 1
+
+def test_frame_rate():
+    assert utils._frame_rate({'avg_frame_rate': '30000/1001'}) == pytest.approx(29.97, abs=0.01)
+    assert utils._frame_rate({'avg_frame_rate': '0/0'}) is None
+    assert utils._frame_rate({}) is None
+
+def test_estimate_frame_count():
+    assert utils._estimate_frame_count(PROBE, VideoProcessingConfig(fps=2.0)) == 21
+    assert utils._estimate_frame_count(PROBE, VideoProcessingConfig(fps=2.0, max_frames=5)) == 5
+    cfg = VideoProcessingConfig(fps=1.0, start_time='00:00:02', end_time='00:00:06')
+    assert utils._estimate_frame_count(PROBE, cfg) == 5
+    assert utils._estimate_frame_count(PROBE, VideoProcessingConfig(keyframes_only=True)) is None
+    assert utils._estimate_frame_count({**PROBE, 'format': {}}, VideoProcessingConfig()) is None
+
+def test_build_stream_command():
+    cfg = VideoProcessingConfig(fps=10.0, resize_scale=0.5, start_time='00:00:01', end_time='00:00:04')
+    stream, width, height = utils._build_stream('in.mp4', cfg, PROBE)
+    assert (width, height) == (32, 24)
+    args = ffmpeg.compile(stream)
+    assert args[args.index('-ss') + 1] == '00:00:01'
+    assert args[args.index('-to') + 1] == '00:00:04'
+    assert args.index('-ss') < args.index('-i')
+    graph = args[args.index('-filter_complex') + 1]
+    assert 'fps=fps=10.0' in graph
+    assert 'scale=32:24' in graph
+    assert 'format=rgb24' in graph
+    assert args[args.index('-pix_fmt') + 1] == 'rgb24'
+    assert 'pipe:' in args
+
+def test_build_stream_rejects_unsupported_options():
+    with pytest.raises(ValueError):
+        utils._build_stream('in.mp4', VideoProcessingConfig(hwaccel='videotoolbox'), PROBE)
+    with pytest.raises(ValueError):
+        utils._build_stream('in.mp4', VideoProcessingConfig(pix_fmt='gray'), PROBE)
+
+class _FakePipe:
+    """Serves n_frames numbered frames the way _FramePipe does"""
+    def __init__(self, n_frames, shape=(2, 2, 3)):
+        self.shape = shape
+        self.frames = [np.full(shape, i, dtype=np.uint8) for i in range(n_frames)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def readinto(self, frame):
+        if not self.frames:
+            return False
+        frame[...] = self.frames.pop(0)
+        return True
+
+    def read(self):
+        return self.frames.pop(0) if self.frames else None
+
+    def finish(self):
+        pass
+
+@pytest.mark.parametrize('estimate, n_frames', [(8, 5), (3, 5), (None, 5), (None, 0)])
+def test_extract_frames_preallocated_and_extra(monkeypatch, estimate, n_frames):
+    monkeypatch.setattr(utils, '_probe_video', lambda path: PROBE)
+    monkeypatch.setattr(utils, '_estimate_frame_count', lambda probe, config: estimate)
+    monkeypatch.setattr(utils, '_FramePipe', lambda path, config, probe: _FakePipe(n_frames))
+    frames = utils.extract_frames_from_video('in.mp4')
+    assert frames.shape == (n_frames, 2, 2, 3)
+    assert [int(frame[0, 0, 0]) for frame in frames] == list(range(n_frames))
+
+def test_mjpeg_encoder_roundtrip():
+    import av
+    y, x = np.mgrid[0:48, 0:64]
+    frame = np.stack([x * 4, y * 5, (x + y) * 2], axis=-1).astype(np.uint8)
+    with utils.MJPEGEncoder() as encoder:
+        jpgs = [encoder.encode(frame), encoder.encode(frame)]
+        with pytest.raises(ValueError, match='does not match'):
+            encoder.encode(np.ascontiguousarray(frame[:24, :32]))
+    assert jpgs[0][:2] == b'\xff\xd8' and jpgs[0] == jpgs[1]
+    decoded = av.CodecContext.create('mjpeg', 'r').decode(av.Packet(jpgs[0]))[0].to_ndarray(format='rgb24')
+    assert np.abs(decoded.astype(int) - frame).mean() < 5
+
+def test_extractor_config_positional_fields():
+    from extractors.extractor import VideoExtractorConfig
+    cfg = VideoExtractorConfig(None, 0.5, 2.0, None, None, 10, 'frames/')
+    assert (cfg.resize_scale, cfg.max_frames, cfg.output_path, cfg.hwaccel) == (0.5, 10, 'frames/', None)
+    assert VideoExtractorConfig(hwaccel='cuda').hwaccel == 'cuda'
+
+def test_select_path_estimate_uses_effective_rate():
+    cfg = VideoProcessingConfig(fps=7.0)
+    assert utils._decimation_step(cfg, 30.0) == 4
+    assert utils._output_fps(cfg, 30.0) == 7.5
+    assert utils._estimate_frame_count(PROBE, cfg) == 76
+    stream, _, _ = utils._build_stream('in.mp4', cfg, PROBE)
+    args = ffmpeg.compile(stream)
+    assert r'select=not(mod(n\,4))' in args[args.index('-filter_complex') + 1]
+    assert utils._decimation_step(VideoProcessingConfig(fps=10.0), 30.0) is None
+
+def test_probe_video_caches_local_files_only(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr(ffmpeg, 'probe', lambda path: calls.append(path) or PROBE)
+    utils._cached_probe.cache_clear()
+    video = tmp_path / 'in.mp4'
+    video.write_bytes(b'')
+    assert utils._probe_video(str(video)) == utils._probe_video(str(video)) == PROBE
+    url = 'https://example.com/in.mp4'
+    utils._probe_video(url)
+    utils._probe_video(url)
+    assert calls == [str(video), url, url]